@@ -1,16 +1,37 @@
 """Tool for mapping the B0 of a magnet using a 3D printer as a motion stage/positioning system"""
 import print3d
 import lakeshore
-import csv
 import argparse
 import numpy as np
-import time
 from alive_progress import alive_bar
 
+try:
+    import point_gen_numba
+except ImportError:
+    point_gen_numba = None # Numba is optional, fall back to the numpy generators
+
+def axis_gen(side, spacing):
+    """Generate the 1D axis of coordinates shared by the point generators
+    Coordinates are generated at the given spacing moving outwards from zero, which is always included.
+
+    args:
+        side:    side length in mm
+        spacing: spacing of points, in mm
+
+    returns:
+        axis:    1D numpy array of coordinates, in ascending order
+    """
+
+    # Step in whole multiples of the spacing so rounding can't add an extra point at the edges.
+    # The small tolerance stops e.g. 2.1/0.7 = 3.0000000000000004 from rounding up to a point at 2.8
+    n = int(np.ceil(side/2/spacing - 1e-9))
+    axis = np.arange(-n, n+1, dtype=np.float64) * spacing
+    return axis
+
 def cube_gen(side, spacing):
     """Generate a numpy array of points occupying a cube of a given side length around a center with a given spacing
     Points are generated at the given spacing moving outwards from the center, which is always included.
-    If the edges aren't an even multiple of the spacing, the
+    If the edges aren't an even multiple of the spacing, the outermost points fall just outside the edges.
 
     args:
         side:    side length in mm
@@ -23,18 +44,13 @@ def cube_gen(side, spacing):
                  ...
                  xN, yN, zN
     """
-    
-    upper_axis = np.arange(0, side/2+spacing, spacing)
-    lower_axis = np.arange(-1*spacing, -1*(side/2+spacing), -1*spacing)[::-1]
-    axis = np.concatenate((upper_axis,lower_axis))
 
-    X, Y, Z = np.meshgrid(axis, axis, axis, indexing='ij')
-    X = X.flatten()
-    Y = Y.flatten()
-    Z = Z.flatten()
+    # Points are stored as float32, plenty for the printer's 1 um resolution
+    axis = axis_gen(side, spacing).astype(np.float32)
 
-    points = np.stack((X, Y, Z)).T
-    points = points[np.lexsort((points[:,2],points[:,1],points[:,0]))]
+    # With an ascending axis, 'ij' indexing already orders the points by X, then Y, then Z
+    X, Y, Z = np.meshgrid(axis, axis, axis, indexing='ij')
+    points = np.column_stack((X.ravel(), Y.ravel(), Z.ravel()))
     return points
 
 def sphere_gen(diameter, spacing):
@@ -52,10 +68,18 @@ def sphere_gen(diameter, spacing):
                  xN, yN, zN
     """
 
-    cube = cube_gen(diameter, spacing)
-    distance = np.sqrt((cube[:,0])**2 + (cube[:,1])**2 + (cube[:,2])**2)
-    index = distance <= diameter/2
-    sphere = cube[index,:]
+    axis = axis_gen(diameter, spacing)
+    # The compiled kernel only pays back its compile time on fine grids
+    if point_gen_numba is not None and axis.size**3 > 4_000_000:
+        return point_gen_numba.sphere_points(axis, diameter/2)
+
+    # Only build the points inside the sphere
+    r2 = axis[:,None,None]**2 + axis[None,:,None]**2 + axis[None,None,:]**2
+    i, j, k = np.nonzero(np.sqrt(r2) <= diameter/2)
+
+    # Radius is tested in float64 so the boundary is unchanged, points are stored as float32
+    coords = axis.astype(np.float32)
+    sphere = np.column_stack((coords[i], coords[j], coords[k]))
     return sphere
 
 def cylinder_gen(diameter, spacing):
@@ -73,10 +97,14 @@ def cylinder_gen(diameter, spacing):
                  xN, yN, zN
     """
 
-    cube = cube_gen(diameter, spacing)
-    distance = np.sqrt((cube[:,0])**2 + (cube[:,1])**2)
-    index = distance <= diameter/2
-    cylinder = cube[index,:]
+    # Radius only depends on X and Y, so test the XY plane and extend each hit along Z
+    axis = axis_gen(diameter, spacing)
+    r2 = axis[:,None]**2 + axis[None,:]**2
+    index = np.broadcast_to((np.sqrt(r2) <= diameter/2)[:,:,None], (axis.size,)*3)
+    i, j, k = np.nonzero(index)
+
+    coords = axis.astype(np.float32)
+    cylinder = np.column_stack((coords[i], coords[j], coords[k]))
     return cylinder
 
 def circle_gen(diameter, spacing):
@@ -94,21 +122,14 @@ def circle_gen(diameter, spacing):
                  xN, yN, zN
     """
 
-    upper_axis = np.arange(0, diameter/2+spacing, spacing)
-    lower_axis = np.arange(-1*spacing, -1*(diameter/2+spacing), -1*spacing)[::-1]
-    axis = np.concatenate((upper_axis,lower_axis))
-
-    Y, Z = np.meshgrid(axis, axis, indexing='ij')
-    Y = Y.flatten()
-    Z = Z.flatten()
-    X = (np.zeros_like(Y)).flatten()
-
-    rect = np.stack((X, Y, Z)).T
-    rect = rect[np.lexsort((rect[:,0],rect[:,1],rect[:,2]))]
+    # X is always zero, so only Y and Z contribute to the radius.
+    # Index the grid as (Z, Y) so the points come out ordered by Z, then Y, without sorting
+    axis = axis_gen(diameter, spacing)
+    r2 = axis[:,None]**2 + axis[None,:]**2
+    k, j = np.nonzero(np.sqrt(r2) <= diameter/2)
 
-    distance = np.sqrt((rect[:,0])**2 + (rect[:,1])**2 + (rect[:,2])**2)
-    index = distance <= diameter/2
-    circle = rect[index,:]
+    coords = axis.astype(np.float32)
+    circle = np.column_stack((np.zeros(j.size, dtype=np.float32), coords[j], coords[k]))
 
     return circle
 
@@ -125,6 +146,7 @@ if __name__ == '__main__':
     parser.add_argument('-p', '--spacing', action='store', default=5, type=float, help='Measurement point spacing in mm')
     parser.add_argument('-r', '--restart', action='store', default=0, type=int, help='Point to start at if restarting')
     parser.add_argument('-m', '--remeasure_interval', action='store', default=10, type=int, help='Maximum number of points to measure before re-measuring center')
+    parser.add_argument('-t', '--settle_time', action='store', default=500, type=int, help='Time to let the probe settle after each move before measuring, in ms')
 
     args = parser.parse_args()
     port_lakeshore = args.probe_port
@@ -138,6 +160,7 @@ if __name__ == '__main__':
     spacing = args.spacing
     start = args.restart
     remeasure_interval = args.remeasure_interval
+    settle_time = args.settle_time
 
     probe = lakeshore.LakeshoreF71(port_lakeshore)
 
@@ -165,7 +188,7 @@ if __name__ == '__main__':
         printer.affine =  np.array([[0,  0,  1, center[0]],
                                     [1,  0,  0, center[1]],
                                     [0, -1,  0, center[2]],
-                                    [0,  0,  0,  0]])
+                                    [0,  0,  0,  1]])
                     
         if shape == 'cube':
             points = cube_gen(diameter, spacing)
@@ -176,45 +199,71 @@ if __name__ == '__main__':
         elif shape == 'circle':
             points = circle_gen(diameter, spacing)
 
+        # Transform all points to printer coordinates and pre-format their move commands
+        points_printer = printer.mag_to_printer(points)
+        xs, ys, zs = np.ascontiguousarray(points_printer.T, dtype=np.float32)
+        moves = printer.move_commands(xs, ys, zs, settle_time)
 
         n_points = points.shape[0]
-        with open(save_name, 'w', newline='') as csvfile:
-            csvwriter = csv.writer(csvfile, dialect='excel')
+        with open(save_name, 'wb', buffering=65536) as csvfile:
+            # Every column is numeric, so rows are formatted straight to bytes
+            # Pick the row formatter for the probe type
             if probe.axes == 1:
-                csvwriter.writerow(['X', 'Y', 'Z', 'Bz', 'T'])
+                csvfile.write(b'X,Y,Z,Bz,T\r\n')
+                row_format = b'%.4f,%.4f,%.4f,%.9g,%.3f\r\n'
+                def format_row(point, field, temp):
+                    return f'{point}: {field}', row_format % (*point, field, temp)
             else:
-                csvwriter.writerow(['X', 'Y', 'Z', 'Mag', 'Bx', 'By', 'Bz', 'T'])
+                csvfile.write(b'X,Y,Z,Mag,Bx,By,Bz,T\r\n')
+                row_format = b'%.4f,%.4f,%.4f,%.9g,%.9g,%.9g,%.9g,%.3f\r\n'
+                def format_row(point, field, temp):
+                    return (f'{point}: Mag:{field[0]}, X:{field[1]}, Y:{field[2]}, Z:{field[3]}',
+                            row_format % (*point, *field, temp))
+
+            # Rows are written out in batches
+            batch = []
+            batch_size = 16
             
             with alive_bar(n_points, dual_line=True) as bar:
-                def measure(point):
-                    printer.move_mag(point)
-                    time.sleep(0.5)
-                    field = probe.get_field()
-                    temp = probe.get_temp()
-                    if probe.axes == 1:    
-                        bar.text(f'{point}: {field}')
-                        csvwriter.writerow([*point, field, temp])
+                def measure(point, move=None):
+                    if move is None:
+                        printer.move_start(printer.mag_to_printer(point), settle_time)
                     else:
-                        bar.text(f'{point}: Mag:{field[0]}, X:{field[1]}, Y:{field[2]}, Z:{field[3]}')
-                        csvwriter.writerow([*point, *field, temp])
+                        printer.move_start_command(move)
+                    # Write out finished rows while the printer is moving
+                    if len(batch) >= batch_size:
+                        csvfile.writelines(batch)
+                        csvfile.flush()
+                        batch.clear()
+                    # The printer dwells for the settle time before reporting the move as finished
+                    printer.move_finish()
+                    field, temp = probe.get_field_and_temp()
+                    text, row = format_row(point, field, temp)
+                    bar.text(text)
+                    batch.append(row)
 
 
                 bar.title('B0 Mapping in Progress')
                 if start !=0:
                     bar(start, skipped=True)
 
-                # measure center to start
-                measure([0,0,0])
-
-                for i in range(start, n_points):
-                    # Re-measure center to track B0 drift
-                    if i % remeasure_interval == 0:
-                        measure([0,0,0])
-                    
-                    point = points[i,:]
-                    measure(point)
-                    bar()
-                # Re-measure center to end
-                measure([0,0,0])
+                try:
+                    # measure center to start
+                    measure([0,0,0])
+
+                    for i in range(start, n_points):
+                        # Re-measure center to track B0 drift
+                        if i % remeasure_interval == 0:
+                            measure([0,0,0])
+                        
+                        point = points[i,:]
+                        measure(point, moves[i])
+                        bar()
+                    # Re-measure center to end
+                    measure([0,0,0])
+                finally:
+                    # Save whatever has been measured, even if interrupted
+                    csvfile.writelines(batch)
+                    csvfile.flush()
 
     printer.beep() # Let everyone know you're done!
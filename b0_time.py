@@ -29,8 +29,7 @@ with open(save_name, 'w', newline='') as csvfile:
         for point in range(n_points):
             time.sleep(1)
             timepoint = datetime.now()
-            field = probe.get_field()
-            temp = probe.get_temp()
+            field, temp = probe.get_field_and_temp()
             bar.text(f'{timepoint}: Mag:{field[0]}, X:{field[1]}, Y:{field[2]}, Z:{field[3]}')
             csvwriter.writerow([timepoint, *field, temp])
             bar()
@@ -9,23 +9,38 @@ class LakeshoreF71():
         print('Tesla Meter Name:',self.inst.query('*IDN?'))
         self.axes = int(self.inst.query('Probe:Axes?'))
         print(f'Operating in {self.axes}-axis mode')
-
-    def get_field(self):
-        """Get field from probe"""
+        # Pick the field readers for the probe type
         if self.axes == 1:
-            field = float(self.inst.query(f'Fetch:DC? X'))
+            self.get_field = self._get_field_1axis
+            self.get_field_and_temp = self._get_field_and_temp_1axis
         else:
-            resp = self.inst.query(f'FETCh:DC? ALL')
-            field = [float(a) for a in resp.split(',')] # Magnitude, X, Y, Z
-        return field
+            self.get_field = self.get_field_3axis
+            self.get_field_and_temp = self._get_field_and_temp_3axis
+
+    def _get_field_1axis(self):
+        """Get field from single-axis probe"""
+        return float(self.inst.query('FETCh:DC? X'))
     
     def get_field_3axis(self):
         """Get field from three-axis probe"""
-        resp = self.inst.query(f'FETCh:DC? ALL')
+        resp = self.inst.query('FETCh:DC? ALL')
         fields = [float(a) for a in resp.split(',')] # Magnitude, X, Y, Z
         return fields
     
     def get_temp(self):
         """Get temperature from field probe"""
-        resp = self.inst.query(f'FETCh:TEMPerature?')
-        return(float(resp))
\ No newline at end of file
+        resp = self.inst.query('FETCh:TEMPerature?')
+        return(float(resp))
+
+    def _get_field_and_temp_1axis(self):
+        """Get field and temperature from single-axis probe in one query"""
+        resp = self.inst.query('FETCh:DC? X;:FETCh:TEMPerature?')
+        field, temp = resp.split(';')
+        return float(field), float(temp)
+
+    def _get_field_and_temp_3axis(self):
+        """Get fields and temperature from three-axis probe in one query"""
+        resp = self.inst.query('FETCh:DC? ALL;:FETCh:TEMPerature?')
+        fields, temp = resp.split(';')
+        fields = [float(a) for a in fields.split(',')] # Magnitude, X, Y, Z
+        return fields, float(temp)
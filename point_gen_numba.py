@@ -0,0 +1,48 @@
+"""Numba-compiled point generators for fine point spacings"""
+import numpy as np
+from numba import njit, prange
+
+@njit(cache=True, parallel=True)
+def sphere_points(axis, radius):
+    """Generate the points of a sphere in a single fused pass without building the full cube
+    Each X slice is counted and then filled in parallel, so points come out in the same order as sphere_gen.
+
+    args:
+        axis:    1D numpy array of coordinates, in ascending order (see axis_gen)
+        radius:  sphere radius in mm
+
+    returns:
+        points:  2D float32 numpy array of points
+                 x0, y0, z0
+                 x0, y0, z1
+                 ...
+                 xN, yN, zN
+    """
+
+    n = axis.size
+
+    # First pass: count the points inside the sphere in each X slice
+    counts = np.zeros(n, dtype=np.int64)
+    for i in prange(n):
+        count = 0
+        for j in range(n):
+            for k in range(n):
+                if np.sqrt(axis[i]**2 + axis[j]**2 + axis[k]**2) <= radius:
+                    count += 1
+        counts[i] = count
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+
+    # Second pass: write each slice's points starting at its offset
+    points = np.empty((offsets[n], 3), dtype=np.float32)
+    for i in prange(n):
+        row = offsets[i]
+        for j in range(n):
+            for k in range(n):
+                if np.sqrt(axis[i]**2 + axis[j]**2 + axis[k]**2) <= radius:
+                    points[row, 0] = axis[i]
+                    points[row, 1] = axis[j]
+                    points[row, 2] = axis[k]
+                    row += 1
+    return points
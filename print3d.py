@@ -1,22 +1,42 @@
+import re
 import serial
 from typing import Union
 import numpy as np
 
 numeric = Union[int, float]
 
+# Position report from M114, e.g. "X:10.00 Y:20.00 Z:5.00 E:0.00 Count ..."
+_POS_RE = re.compile(rb'X:(-?\d+\.\d+) Y:(-?\d+\.\d+) Z:(-?\d+\.\d+) E:')
+
+# Move, dwell (ms) and completion report, at 1 um resolution
+_MOVE_START = b'G0 X%.3f Y%.3f Z%.3f\nG4 P%d\nM400\nM118 Finished\n'
+
 class Printer:
     """Defines an interface to a 3D printer over serial"""
     def __init__(self, port, baudrate = 115200):
-        self.ser = serial.Serial(port=port, baudrate=baudrate)
+        self.ser = serial.Serial(port=port, baudrate=baudrate, timeout=None) # Block on reads, moves can take a while
         self.set_absolute()
         self.write('M18 S0\n') # Disable motor timeout
         self.write('M92 X800 Y800\n') # Change Steps per mm
-        self.write('M201 X200 Y200') # Change acceleration
+        self.write('M201 X200 Y200\n') # Change acceleration
+        self.write('M155 S0\nM111 S0\n') # Stop temperature auto-reports and debug output to keep the serial line quiet
 
         self.affine = np.array([[0,  0,  1,  0],
                                 [1,  0,  0,  0],
                                 [0, -1,  0,  0],
                                 [0,  0,  0,  1]])
+
+    @property
+    def affine(self):
+        """Affine transformation from the magnet to the printer coordinate system"""
+        return self._affine
+
+    @affine.setter
+    def affine(self, affine: np.ndarray):
+        # Keep the rotation and translation parts separately so transforms skip the homogeneous coordinate
+        self._affine = affine
+        self._R = affine[:3,:3].astype(np.float32)
+        self._t = affine[:3,3].astype(np.float32)
     
     def write(self, command: str):
         """Write a string encoded properly for the printer"""
@@ -51,18 +71,54 @@ class Printer:
         Args:
             position (tuple[numeric, numeric, numeric]):
         """
-        self.write(f'G0 X{position[0]} Y{position[1]} Z{position[2]}\n')
+        self.ser.write(b'G0 X%.3f Y%.3f Z%.3f\n' % (position[0], position[1], position[2])) # 1 um resolution keeps the command short
     
     def wait(self):
         """Wait for previous command to complete and return once it has."""
-        self.write('M400\nM118 Finished\n')
-        finished = False
-        while not finished:
-            read = self.read()
-            # read = self.ser.readline().decode()
-            # print(read)
-            if read[:8] == 'Finished':
-                finished = True
+        self.ser.write(b'M400\nM118 Finished\n')
+        self.move_finish()
+
+    def move_start(self, position: tuple[numeric, numeric, numeric], dwell_ms: int = 0):
+        """Start a move to/by specified position/ammount in printer coordinate system and return without waiting
+        The move and the completion report are sent together, so call move_finish to wait for the move to complete.
+
+        Args:
+            position (tuple[numeric, numeric, numeric]):
+            dwell_ms (int): time for the printer to wait after the move before reporting completion
+        """
+        self.move_start_command(_MOVE_START % (position[0], position[1], position[2], dwell_ms))
+
+    def move_start_command(self, command: bytes):
+        """Start a move using a command pre-formatted by move_commands and return without waiting
+
+        Args:
+            command (bytes):
+        """
+        self.ser.reset_input_buffer()
+        self.ser.write(command)
+
+    def move_commands(self, xs: np.ndarray, ys: np.ndarray, zs: np.ndarray, dwell_ms: int = 0):
+        """Pre-format move_start commands for many positions in printer coordinate system
+
+        Args:
+            xs (np.ndarray): X coordinates
+            ys (np.ndarray): Y coordinates
+            zs (np.ndarray): Z coordinates
+            dwell_ms (int): time for the printer to wait after each move before reporting completion
+        """
+        # Format every command in a single call, separated by NUL bytes, then split them apart
+        values = [None] * (4 * len(xs))
+        values[0::4] = xs.tolist()
+        values[1::4] = ys.tolist()
+        values[2::4] = zs.tolist()
+        values[3::4] = [int(dwell_ms)] * len(xs)
+        buffer = ((_MOVE_START + b'\0') * len(xs)) % tuple(values)
+        return buffer.split(b'\0')[:-1]
+
+    def move_finish(self):
+        """Wait for a move started with move_start to complete and return once it has."""
+        self.ser.read_until(b'Finished')
+        self.ser.read_until(b'\n')
 
     def move_wait(self, position: tuple[numeric, numeric, numeric]):
         """Move to/by specified position/ammount in printer coordinate system and wait until move is complete before returning
@@ -72,33 +128,34 @@ class Printer:
         Args:
             position (tuple[numeric, numeric, numeric]):
         """
-        self.ser.reset_input_buffer()
-        self.write(f'G0 X{position[0]} Y{position[1]} Z{position[2]}\n')
-        self.wait()
+        self.move_start(position)
+        self.move_finish()
     
+    def mag_to_printer(self, positions: np.ndarray):
+        """Transform position(s) from the magnet coordinate system to the printer coordinate system
+
+        Args:
+            positions (np.ndarray): a single position or an N x 3 array of positions
+        """
+        return positions @ self._R.T + self._t
+
     def move_mag(self, position: tuple[numeric, numeric, numeric]):
         """Move to specified position in magnet coordinate system and wait until move is complete before returning
 
         Args:
             position (tuple[numeric, numeric, numeric]):
         """
-        pos_magnet = np.append(position,1)
-        pos_printer = (self.affine @ pos_magnet)[0:3]
-        self.move_wait(pos_printer)
+        self.move_wait(self.mag_to_printer(np.asarray(position, dtype=np.float32)))
 
     def get_pos(self):
         """Get current position of printer"""
         self.ser.reset_input_buffer()
         self.write('M114\n')
-        read = self.read()
-        i_x = read.index('X:')
-        i_y = read.index('Y:')
-        i_z = read.index('Z:')
-        i_end = read.index('E:')
-        X = float(read[i_x+2:i_y])
-        Y = float(read[i_y+2:i_z])
-        Z = float(read[i_z+2:i_end])
-        return (X, Y, Z)
+        read = self.ser.readline()
+        match = _POS_RE.search(read)
+        if match is None:
+            raise ValueError(f'Could not parse printer position from {read!r}')
+        return tuple(float(g) for g in match.groups())
 
     def beep(self, t_ms:int = 100):
         """Beep!"""